@@ -95,6 +95,28 @@ FOREIGN KEY (region_id) REFERENCES region_dim(region_id) NOT ENFORCED;
 -- Grant select permissions on tables to cortex_user_role
 GRANT SELECT ON ALL TABLES IN SCHEMA cortex_analyst_demo.revenue_timeseries TO ROLE cortex_user_role;
 
+/*--
+Chat History Storage
+Used by the Streamlit app to persist conversations across page reloads
+--*/
+
+-- Schema for app state
+CREATE OR REPLACE SCHEMA cortex_analyst_demo.chat
+    COMMENT = 'Schema containing Streamlit chat history';
+
+-- Chat messages, one row per turn
+CREATE OR REPLACE TABLE cortex_analyst_demo.chat.messages (
+    session_id STRING COMMENT 'Chat session identifier',
+    turn INT COMMENT 'Position of the message in the session',
+    role STRING COMMENT 'user or assistant',
+    content VARIANT COMMENT 'Message text or Cortex Analyst response',
+    ts TIMESTAMP_LTZ COMMENT 'Time the message was stored'
+) COMMENT = 'Cortex Analyst demo chat history';
+
+-- Grant the app role read/write access to chat history
+GRANT USAGE ON SCHEMA cortex_analyst_demo.chat TO ROLE cortex_user_role;
+GRANT SELECT, INSERT ON TABLE cortex_analyst_demo.chat.messages TO ROLE cortex_user_role;
+
 -- Display created objects
 SELECT 'Database created: ' || DATABASE_NAME as STATUS FROM INFORMATION_SCHEMA.DATABASES WHERE DATABASE_NAME = 'CORTEX_ANALYST_DEMO'
 UNION ALL
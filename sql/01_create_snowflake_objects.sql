@@ -71,3 +71,20 @@ CREATE OR REPLACE TABLE cortex_analyst_demo.revenue_timeseries.region_dim (
     sales_region VARCHAR(16777216),
     state VARCHAR(16777216)
 );
+
+/*--
+• Chat History Table (used by the Streamlit app)
+--*/
+
+CREATE OR REPLACE SCHEMA cortex_analyst_demo.chat;
+
+CREATE OR REPLACE TABLE cortex_analyst_demo.chat.messages (
+    session_id STRING,
+    turn INT,
+    role STRING,
+    content VARIANT,
+    ts TIMESTAMP_LTZ
+);
+
+GRANT USAGE ON SCHEMA cortex_analyst_demo.chat TO ROLE cortex_user_role;
+GRANT SELECT, INSERT ON TABLE cortex_analyst_demo.chat.messages TO ROLE cortex_user_role;
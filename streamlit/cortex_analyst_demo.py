@@ -12,9 +12,12 @@ This app demonstrates how to:
 import streamlit as st
 import pandas as pd
 import json
+import time
+from uuid import uuid4
 from typing import List, Dict, Tuple, Optional
 import snowflake.permissions as permissions
 from snowflake.snowpark.context import get_active_session
+from snowflake.snowpark.exceptions import SnowparkSQLException
 
 # Configure Streamlit page
 st.set_page_config(
@@ -28,8 +31,140 @@ st.set_page_config(
 API_ENDPOINT = "/api/v2/cortex/analyst/message"
 API_TIMEOUT = 30000  # 30 seconds
 
+# Chat history persistence
+CHAT_TABLE = "cortex_analyst_demo.chat.messages"
+HISTORY_RENDER_LIMIT = 20  # Number of most recent messages to render
+INTERACTIVE_MESSAGE_LIMIT = 10  # Older rendered messages are shown without full widgets
+
+QUERY_POLL_INTERVAL = 0.25  # Seconds between async query status checks
+PROMPT_BATCH_WINDOW = 0.2  # Seconds to wait for follow-up clicks before calling Analyst
+
+# Sample questions shown in the sidebar, with stable widget keys
+SAMPLE_QUESTIONS = [("sample_%d" % i, q) for i, q in enumerate([
+    "What questions can I ask?",
+    "What was our total revenue last month?",
+    "Which product line has the highest profit margin?",
+    "Show me revenue trends by region",
+    "Compare actual vs forecasted revenue",
+    "What is our average daily revenue by product line?",
+    "Which region has the lowest cost of goods sold?",
+    "Show me profit margins over time",
+    "What are the top 5 days by revenue?",
+    "How accurate are our revenue forecasts?"
+])]
+
+@st.cache_resource
+def get_session():
+    """
+    Get the Snowflake session once and share it across reruns.
+    
+    The session is tagged so the app's queries are easy to find in query
+    history. Tagging is best effort: owner's rights apps may not be allowed
+    to set session parameters, and the app works without the tag.
+    """
+    session = get_active_session()
+    try:
+        session.sql("ALTER SESSION SET QUERY_TAG = 'cortex_analyst_demo'").collect()
+    except Exception:
+        pass
+    return session
+
 # Get Snowflake session
-session = get_active_session()
+session = get_session()
+
+@st.cache_resource
+def chat_store_available() -> bool:
+    """
+    Check once per app process whether the chat history table is usable.
+    
+    The table is created by sql/01_create_objects.sql; without it (or
+    without access to it) the app runs with in-memory history only.
+    """
+    try:
+        session.sql(f"SELECT 1 FROM {CHAT_TABLE} LIMIT 0").collect()
+        return True
+    except Exception:
+        return False
+
+def _rendered_view(content) -> Dict:
+    """
+    Pre-extract the displayable fields of a message once, when it is added.
+    
+    Args:
+        content: Message text or the parsed Cortex Analyst response
+        
+    Returns:
+        Dict: The message "text", generated "sql" and follow-up "suggestions"
+    """
+    if isinstance(content, dict):
+        return {
+            "text": content.get("message"),
+            "sql": content.get("sql"),
+            "suggestions": content.get("suggestions") or [],
+        }
+    return {"text": content, "sql": None, "suggestions": []}
+
+def load_recent_messages(session_id: str) -> List[Dict]:
+    """
+    Load the tail of a persisted conversation.
+    
+    Args:
+        session_id (str): The chat session to load
+        
+    Returns:
+        List[Dict]: Up to HISTORY_RENDER_LIMIT messages, oldest first
+    """
+    rows = session.sql(
+        f"SELECT turn, role, content FROM {CHAT_TABLE} "
+        "WHERE session_id = ? ORDER BY turn DESC LIMIT ?",
+        params=[session_id, HISTORY_RENDER_LIMIT]
+    ).collect()
+    if rows:
+        st.session_state.next_turn = rows[0]["TURN"] + 1
+    messages = []
+    for row in reversed(rows):
+        content = json.loads(row["CONTENT"])
+        messages.append({
+            "role": row["ROLE"],
+            "content": content,
+            "rendered": _rendered_view(content),
+        })
+    return messages
+
+def new_chat_session_id() -> str:
+    """Start a new chat session and remember it in the page URL."""
+    session_id = f"{session.get_current_account()}-{uuid4()}"
+    st.session_state.session_id = session_id
+    st.session_state.next_turn = 0
+    st.query_params["session"] = session_id
+    return session_id
+
+def append_message(role: str, content):
+    """
+    Add a message to the chat history and persist it.
+    
+    Persistence is best effort: if the INSERT fails the message is still
+    kept in memory, so the conversation carries on without a traceback.
+    
+    Args:
+        role (str): "user" or "assistant"
+        content: Message text or the parsed Cortex Analyst response
+    """
+    try:
+        if chat_store_available():
+            session.sql(
+                f"INSERT INTO {CHAT_TABLE} (session_id, turn, role, content, ts) "
+                "SELECT ?, ?, ?, PARSE_JSON(?), CURRENT_TIMESTAMP()",
+                params=[st.session_state.session_id, st.session_state.next_turn, role, json.dumps(content)]
+            ).collect()
+    except Exception:
+        st.toast("Chat history could not be saved", icon="⚠️")
+    st.session_state.messages.append({
+        "role": role,
+        "content": content,
+        "rendered": _rendered_view(content),
+    })
+    st.session_state.next_turn += 1
 
 # App Header
 st.title("🧠 Snowflake Cortex Analyst Demo")
@@ -55,22 +190,9 @@ with st.sidebar:
     
     # Sample questions
     st.subheader("💡 Try These Questions:")
-    sample_questions = [
-        "What questions can I ask?",
-        "What was our total revenue last month?",
-        "Which product line has the highest profit margin?",
-        "Show me revenue trends by region",
-        "Compare actual vs forecasted revenue",
-        "What is our average daily revenue by product line?",
-        "Which region has the lowest cost of goods sold?",
-        "Show me profit margins over time",
-        "What are the top 5 days by revenue?",
-        "How accurate are our revenue forecasts?"
-    ]
-    
-    for question in sample_questions:
-        if st.button(question, key=f"sample_{hash(question)}", use_container_width=True):
-            st.session_state.user_input = question
+    for key, question in SAMPLE_QUESTIONS:
+        if st.button(question, key=key, use_container_width=True):
+            st.session_state.setdefault("pending_prompts", []).append(question)
 
     st.divider()
     
@@ -90,13 +212,212 @@ with st.sidebar:
     - **Metrics**: Revenue, costs, profit, forecasts
     """)
 
-# Initialize chat history
+# Initialize chat history, restoring the tail of a persisted session if the
+# page URL carries one
 if "messages" not in st.session_state:
-    st.session_state.messages = []
+    st.session_state.next_turn = 0
+    if "session" in st.query_params and chat_store_available():
+        st.session_state.session_id = st.query_params["session"]
+        st.session_state.messages = load_recent_messages(st.session_state.session_id)
+    else:
+        new_chat_session_id()
+        st.session_state.messages = []
+
+def _message_text(message: Dict) -> str:
+    """Flatten a chat message into plain text for summarization."""
+    content = message["content"]
+    if isinstance(content, dict):
+        content = content.get("message") or json.dumps(content)
+    return f"{message['role']}: {content}"
+
+def build_context(messages: List[Dict], k: int = 8, max_chars: int = 8000) -> List[Dict]:
+    """
+    Bound the conversation history sent to Cortex Analyst.
+    
+    Recent messages are kept verbatim; older ones are rolled into a summary
+    in blocks of about `k`. Each roll summarizes only the previous summary
+    plus the block that just left the window, so SUMMARIZE runs once per `k`
+    new messages. Blocks always end just before a user turn, so the window
+    starts on one; the summary is folded into that first user message to
+    keep user and analyst turns alternating. The summary is kept in session
+    state between turns.
+    
+    Args:
+        messages (List[Dict]): The full conversation history
+        k (int): Number of messages rolled into the summary at a time
+        max_chars (int): Size budget for the text passed to SUMMARIZE
+        
+    Returns:
+        List[Dict]: The messages to send to Cortex Analyst
+    """
+    cached = st.session_state.get("history_summary") or {"rolled": 0, "summary": None}
+    while len(messages) - cached["rolled"] >= 2 * k:
+        end = cached["rolled"] + k
+        while end < len(messages) and messages[end]["role"] != "user":
+            end += 1
+        block = messages[cached["rolled"]:end]
+        # Share the budget between the previous summary and each rolled message
+        per_part = max_chars // (k + 1)
+        parts = []
+        if cached["summary"]:
+            parts.append("Earlier conversation: " + cached["summary"][:per_part])
+        parts += [_message_text(m)[:per_part] for m in block]
+        row = session.sql(
+            "SELECT SNOWFLAKE.CORTEX.SUMMARIZE(?) AS summary",
+            params=["\n".join(parts)]
+        ).first()
+        cached = {"rolled": end, "summary": row["SUMMARY"]}
+        st.session_state["history_summary"] = cached
+    
+    # Send only what the API expects, not the UI-only "rendered" view
+    recent = [
+        {"role": m["role"], "content": m["content"]}
+        for m in messages[cached["rolled"]:]
+    ]
+    if cached["summary"] is not None and recent:
+        recent[0]["content"] = f"<SUMMARY>: {cached['summary']}\n\n{recent[0]['content']}"
+    return recent
+
+def _wait_for_job(job, status=None):
+    """
+    Poll an async Snowpark job until it finishes.
+    
+    Args:
+        job: The AsyncJob returned by collect_nowait()
+        status: Optional st.status container to report elapsed time in
+        
+    Returns:
+        The finished job
+    """
+    start = time.time()
+    while not job.is_done():
+        if status is not None:
+            status.update(label=f"Executing query... {time.time() - start:.0f}s")
+        time.sleep(QUERY_POLL_INTERVAL)
+    return job
+
+@st.cache_data(show_spinner=False)
+def _snowsight_query_url_prefix() -> str:
+    """Base URL of the Snowsight query detail page for the current account."""
+    row = session.sql(
+        "SELECT CURRENT_ORGANIZATION_NAME() AS org, CURRENT_ACCOUNT_NAME() AS account"
+    ).first()
+    return (
+        f"https://app.snowflake.com/{row['ORG'].lower()}/{row['ACCOUNT'].lower()}"
+        "/#/compute/history/queries/"
+    )
+
+def _query_id_markdown(query_id: str) -> str:
+    """Query id with a Snowsight link, or the bare id if the link can't be built."""
+    try:
+        url = f"{_snowsight_query_url_prefix()}{query_id}/detail"
+    except Exception:
+        return f"Query ID: `{query_id}`"
+    return f"Query ID: `{query_id}` ([view in Snowsight]({url}))"
 
-# Initialize user input
-if "user_input" not in st.session_state:
-    st.session_state.user_input = ""
+@st.cache_data(ttl=3600, show_spinner=False)
+def _analyst_call(messages_json: str, model_path: str) -> Optional[str]:
+    """Call Cortex Analyst, memoized on the serialized history and model path."""
+    row = session.sql(
+        "SELECT SNOWFLAKE.CORTEX.ANALYST(?, ?) AS response",
+        params=[messages_json, model_path]
+    ).first()
+    return row['RESPONSE'] if row else None
+
+def _qid_key(message_index: int) -> str:
+    """Session state key of the stored query id for a message in this chat."""
+    return f"qid_{st.session_state.session_id}_{message_index}"
+
+def _is_missing_result_error(error: SnowparkSQLException, query_id: str) -> bool:
+    """Whether RESULT_SCAN failed because the stored query result is gone."""
+    message = str(error).lower()
+    return "has expired" in message or (
+        query_id.lower() in message and "not found" in message
+    )
+
+def _result_source(sql: str, message_index: int, status=None) -> str:
+    """
+    Return a statement that reads the results of the generated SQL.
+    
+    The generated SQL is executed on the warehouse once per message; its
+    query id is kept in session state and later reads (re-clicks, other
+    pages, downloads) go through RESULT_SCAN instead of re-executing it.
+    
+    Args:
+        sql (str): The SQL generated by Cortex Analyst
+        message_index (int): Position of the response in the chat history
+        status: Optional st.status container to report progress in
+        
+    Returns:
+        str: A SELECT over the persisted query result
+    """
+    qid_key = _qid_key(message_index)
+    if qid_key not in st.session_state:
+        job = session.sql(sql.strip().rstrip(';')).collect_nowait()
+        if status is not None:
+            status.markdown(_query_id_markdown(job.query_id))
+        _wait_for_job(job, status)
+        job.result(result_type="no_result")  # Raise on failure without fetching rows
+        st.session_state[qid_key] = job.query_id
+    return f"SELECT * FROM TABLE(RESULT_SCAN('{st.session_state[qid_key]}'))"
+
+def _read_results(sql: str, message_index: int, read, status=None):
+    """
+    Read the results of the generated SQL, re-executing it if needed.
+    
+    Persisted query results expire after 24 hours, after which RESULT_SCAN
+    fails; on that error only, the stored query id is dropped and the query
+    run again. Any other read error is raised as is.
+    
+    Args:
+        sql (str): The SQL generated by Cortex Analyst
+        message_index (int): Position of the response in the chat history
+        read: Callable taking the RESULT_SCAN statement and returning the data
+        status: Optional st.status container to report progress in
+        
+    Returns:
+        Tuple[str, Any]: The RESULT_SCAN statement used and the data read
+    """
+    source_sql = _result_source(sql, message_index, status)
+    try:
+        return source_sql, read(source_sql)
+    except SnowparkSQLException as e:
+        if not _is_missing_result_error(e, st.session_state[_qid_key(message_index)]):
+            raise
+        st.session_state.pop(_qid_key(message_index), None)
+        source_sql = _result_source(sql, message_index, status)
+        return source_sql, read(source_sql)
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def _run_query(sql: str, limit: int, offset: int = 0) -> pd.DataFrame:
+    """Execute one page of generated SQL, memoized on the statement and page."""
+    source = sql.strip().rstrip(';')
+    # LIMIT/OFFSET need a total order for pages not to overlap or skip rows
+    order_by = ", ".join(str(i) for i in range(1, len(session.sql(source).columns) + 1))
+    paged_sql = f"SELECT * FROM ({source}) ORDER BY {order_by} LIMIT ? OFFSET ?"
+    return session.sql(paged_sql, params=[limit, offset]).to_pandas()
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def _numeric_summary(sql: str, limit: int, offset: int = 0) -> Optional[pd.DataFrame]:
+    """Summary statistics of the numeric columns of one result page."""
+    numeric_df = _run_query(sql, limit, offset).select_dtypes(include='number')
+    return numeric_df.describe() if not numeric_df.empty else None
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def _page_csv(sql: str, limit: int, offset: int = 0) -> str:
+    """CSV text of one result page, serialized once per page."""
+    return _run_query(sql, limit, offset).to_csv(index=False)
+
+def _iter_csv_chunks(sql: str):
+    """Yield the full result set as CSV text, one pandas batch at a time."""
+    header = True
+    for batch in session.sql(sql.strip().rstrip(';')).to_pandas_batches():
+        yield batch.to_csv(index=False, header=header)
+        header = False
+
+def _full_csv(sql: str) -> str:
+    """Build the CSV for the full result set without materializing a DataFrame."""
+    return "".join(_iter_csv_chunks(sql))
 
 def get_analyst_response(messages: List[Dict]) -> Tuple[Dict, Optional[str]]:
     """
@@ -109,25 +430,13 @@ def get_analyst_response(messages: List[Dict]) -> Tuple[Dict, Optional[str]]:
         Tuple[Dict, Optional[str]]: Response and error message if any
     """
     try:
-        # Prepare the request body
-        request_body = {
-            "messages": messages,
-            "semantic_model_file": st.session_state.selected_semantic_model_path,
-        }
-        
-        # Call Cortex Analyst using SQL interface
-        sql_query = f"""
-        SELECT SNOWFLAKE.CORTEX.ANALYST(
-            '{json.dumps(messages)}',
-            '{st.session_state.selected_semantic_model_path}'
-        ) as response
-        """
+        # Call Cortex Analyst (cached for repeated prompts)
+        response_str = _analyst_call(
+            json.dumps(messages, sort_keys=True),
+            st.session_state.selected_semantic_model_path
+        )
         
-        # Execute the query
-        result = session.sql(sql_query).collect()
-        
-        if result and len(result) > 0:
-            response_str = result[0]['RESPONSE']
+        if response_str:
             parsed_response = json.loads(response_str)
             return parsed_response, None
         else:
@@ -150,12 +459,91 @@ def get_analyst_response(messages: List[Dict]) -> Tuple[Dict, Optional[str]]:
         """
         return {}, error_msg
 
-def display_response(response: Dict):
+def display_query_results(sql: str, message_index: int):
+    """
+    Display the paging controls, results and downloads for generated SQL.
+    
+    Args:
+        sql (str): The SQL generated by Cortex Analyst
+        message_index (int): Position of the response in the chat history
+    """
+    # Page through results instead of fetching the whole result set
+    limit_col, offset_col = st.columns(2)
+    row_limit = limit_col.number_input(
+        "Row limit", min_value=1, value=1000, step=100,
+        key=f"row_limit_{message_index}"
+    )
+    row_offset = offset_col.number_input(
+        "Row offset", min_value=0, value=0, step=int(row_limit),
+        key=f"row_offset_{message_index}"
+    )
+    st.caption("Rows are sorted by every column, left to right, so pages stay stable.")
+    
+    # Option to execute the SQL and show results
+    if st.button("▶️ Execute Query and Show Results", key=f"execute_sql_{message_index}"):
+        try:
+            with st.status("Executing query...", expanded=True) as status:
+                source_sql, result_df = _read_results(
+                    sql, message_index,
+                    lambda source: _run_query(source, int(row_limit), int(row_offset)),
+                    status
+                )
+                status.update(label="Query complete", state="complete", expanded=False)
+            
+            if not result_df.empty:
+                st.subheader("📋 Query Results")
+                
+                # Display as data table
+                st.dataframe(
+                    result_df, 
+                    use_container_width=True,
+                    hide_index=True
+                )
+                
+                # Show basic statistics if numeric data
+                summary_df = _numeric_summary(
+                    source_sql, int(row_limit), int(row_offset)
+                )
+                if summary_df is not None:
+                    with st.expander("📊 Data Summary"):
+                        st.write(summary_df)
+                
+                # Option to download the page shown above
+                st.download_button(
+                    label="💾 Download Results as CSV",
+                    data=_page_csv(source_sql, int(row_limit), int(row_offset)),
+                    file_name="cortex_analyst_results.csv",
+                    mime="text/csv",
+                    key=f"download_csv_{message_index}"
+                )
+            else:
+                st.info("Query executed successfully but returned no results.")
+                
+        except Exception as e:
+            st.error(f"Error executing SQL query: {str(e)}")
+    
+    # The full result set is only serialized when explicitly requested
+    if st.button("📦 Prepare Full CSV Download", key=f"prepare_full_csv_{message_index}"):
+        try:
+            with st.spinner("Preparing full download..."):
+                _, full_csv = _read_results(sql, message_index, _full_csv)
+            st.download_button(
+                label="💾 Download All Results as CSV",
+                data=full_csv,
+                file_name="cortex_analyst_results_full.csv",
+                mime="text/csv",
+                key=f"download_full_csv_{message_index}"
+            )
+        except Exception as e:
+            st.error(f"Error preparing download: {str(e)}")
+
+def display_response(response: Dict, message_index: int):
     """
     Display the Cortex Analyst response with proper formatting
     
     Args:
         response (Dict): The response from Cortex Analyst
+        message_index (int): Position of the response in the chat history
     """
     if "message" in response:
         st.write(response["message"])
@@ -165,63 +553,60 @@ def display_response(response: Dict):
         st.subheader("🔍 Generated SQL Query")
         st.code(response["sql"], language="sql")
         
-        # Option to execute the SQL and show results
-        if st.button("▶️ Execute Query and Show Results", key="execute_sql"):
-            try:
-                with st.spinner("Executing query..."):
-                    result_df = session.sql(response["sql"]).to_pandas()
-                    
-                    if not result_df.empty:
-                        st.subheader("📋 Query Results")
-                        
-                        # Display as data table
-                        st.dataframe(
-                            result_df, 
-                            use_container_width=True,
-                            hide_index=True
-                        )
-                        
-                        # Show basic statistics if numeric data
-                        numeric_cols = result_df.select_dtypes(include=['number']).columns
-                        if len(numeric_cols) > 0:
-                            with st.expander("📊 Data Summary"):
-                                st.write(result_df[numeric_cols].describe())
-                        
-                        # Option to download results
-                        csv = result_df.to_csv(index=False)
-                        st.download_button(
-                            label="💾 Download Results as CSV",
-                            data=csv,
-                            file_name="cortex_analyst_results.csv",
-                            mime="text/csv"
-                        )
-                    else:
-                        st.info("Query executed successfully but returned no results.")
-                        
-            except Exception as e:
-                st.error(f"Error executing SQL query: {str(e)}")
+        display_query_results(response["sql"], message_index)
     
     # Display suggestions if available
     if "suggestions" in response and response["suggestions"]:
         st.subheader("💭 Suggested Follow-up Questions")
-        for suggestion in response["suggestions"]:
-            if st.button(suggestion, key=f"suggestion_{hash(suggestion)}"):
-                st.session_state.user_input = suggestion
+        for i, suggestion in enumerate(response["suggestions"]):
+            if st.button(suggestion, key=f"suggestion_{message_index}_{i}"):
+                st.session_state.setdefault("pending_prompts", []).append(suggestion)
+
+def render_cached(rendered: Dict):
+    """
+    Display a message from its pre-extracted fields, without any widgets.
+    
+    Args:
+        rendered (Dict): The message's "rendered" view
+    """
+    if rendered["text"]:
+        st.write(rendered["text"])
+    if rendered["sql"]:
+        st.code(rendered["sql"], language="sql")
 
 # Main chat interface
 st.subheader("💬 Chat with Your Data")
 
-# Display chat history
-for message in st.session_state.messages:
+# Display chat history. Only the most recent messages get interactive
+# widgets; older ones are rendered from their pre-extracted fields, with
+# query controls behind a toggle.
+first_rendered = max(len(st.session_state.messages) - HISTORY_RENDER_LIMIT, 0)
+first_interactive = max(len(st.session_state.messages) - INTERACTIVE_MESSAGE_LIMIT, 0)
+if first_rendered < first_interactive:
+    # A scrollable container rather than an expander: the query controls
+    # use st.status and expanders, which cannot be nested in an expander
+    st.caption("🕘 Earlier messages")
+    with st.container(height=400):
+        for idx in range(first_rendered, first_interactive):
+            message = st.session_state.messages[idx]
+            with st.chat_message(message["role"]):
+                render_cached(message["rendered"])
+                # A single toggle keeps earlier results reachable; the full
+                # controls are only built when it is switched on
+                if message["rendered"]["sql"] and st.toggle(
+                    "Show query controls", key=f"query_controls_{idx}"
+                ):
+                    display_query_results(message["rendered"]["sql"], idx)
+
+for idx, message in enumerate(
+    st.session_state.messages[first_interactive:], start=first_interactive
+):
+    rendered = message["rendered"]
     with st.chat_message(message["role"]):
-        if message["role"] == "user":
-            st.write(message["content"])
+        if rendered["sql"] or rendered["suggestions"]:
+            display_response(message["content"], idx)
         else:
-            # For assistant messages, parse if it's a JSON response
-            if isinstance(message["content"], dict):
-                display_response(message["content"])
-            else:
-                st.write(message["content"])
+            render_cached(rendered)
 
 # Chat input with session state handling
 user_input = st.chat_input(
@@ -229,57 +614,61 @@ user_input = st.chat_input(
     key="chat_input"
 )
 
-# Handle user input from either chat input or sample questions
-if user_input or st.session_state.user_input:
-    # Use the input from either source
-    current_input = user_input if user_input else st.session_state.user_input
-    
-    # Clear the session state input
-    if st.session_state.user_input:
-        st.session_state.user_input = ""
-    
-    # Add user message to chat history
-    st.session_state.messages.append({"role": "user", "content": current_input})
-    
+# Queue input from the chat box, sample questions and suggestions, and
+# submit everything queued as a single event. The queue is popped when it
+# is submitted, so the same click is never sent to Cortex Analyst twice.
+if user_input:
+    st.session_state.setdefault("pending_prompts", []).append(user_input)
+
+pending = None
+if st.session_state.get("pending_prompts"):
+    # Give quick follow-up clicks a moment to join this batch. A click during
+    # the wait interrupts this run, and its prompt is queued for the rerun.
+    batch_notice = st.empty()
+    batch_notice.caption("Collecting questions...")
+    time.sleep(PROMPT_BATCH_WINDOW)
+    batch_notice.empty()
+    # Batched prompts are sent as one user turn, since Analyst expects user
+    # and analyst turns to alternate
+    pending = "\n\n".join(dict.fromkeys(st.session_state.pending_prompts))
+
+if pending:
     # Display user message
     with st.chat_message("user"):
-        st.write(current_input)
+        st.write(pending)
     
     # Get AI response
     with st.chat_message("assistant"):
-        with st.spinner("🤔 Thinking..."):
+        with st.status("🤔 Thinking..."):
             try:
-                response, error = get_analyst_response(st.session_state.messages)
-                
-                if error:
-                    st.error(error)
-                    # Add error to chat history
-                    st.session_state.messages.append({
-                        "role": "assistant", 
-                        "content": f"Error: {error}"
-                    })
-                else:
-                    # Display the response
-                    display_response(response)
-                    
-                    # Add response to chat history
-                    st.session_state.messages.append({
-                        "role": "assistant", 
-                        "content": response
-                    })
-                    
+                response, error = get_analyst_response(
+                    build_context(
+                        st.session_state.messages + [{"role": "user", "content": pending}]
+                    )
+                )
+                reply = f"Error: {error}" if error else response
             except Exception as e:
-                error_msg = f"Unexpected error: {str(e)}"
-                st.error(error_msg)
-                st.session_state.messages.append({
-                    "role": "assistant", 
-                    "content": error_msg
-                })
+                reply = f"Unexpected error: {str(e)}"
+    
+    # Only once a reply exists is the queue popped and the turn recorded. If
+    # Streamlit stops this run mid-call, the prompts stay queued and no
+    # unanswered user turn is left in the history.
+    st.session_state.pop("pending_prompts", None)
+    append_message("user", pending)
+    append_message("assistant", reply)
+    
+    # Render the new turn from history instead of re-entering this branch
+    st.rerun()
 
 # Clear chat history button
 if st.session_state.messages:
     if st.button("🗑️ Clear Chat History", type="secondary"):
         st.session_state.messages = []
+        st.session_state.pop("history_summary", None)
+        st.session_state.pop("pending_prompts", None)
+        for key in [k for k in st.session_state if k.startswith("qid_")]:
+            del st.session_state[key]
+        new_chat_session_id()
         st.rerun()
 
 # Footer with information
@@ -300,6 +689,7 @@ with st.expander("🔧 Technical Details"):
     st.write("**Current Session Info:**")
     st.write(f"- **Semantic Model:** `{st.session_state.selected_semantic_model_path}`")
     st.write(f"- **Messages in History:** {len(st.session_state.messages)}")
+    st.write(f"- **Chat Session:** `{st.session_state.session_id}`")
     st.write(f"- **Snowflake Account:** `{session.get_current_account()}`")
     st.write(f"- **Current Database:** `{session.get_current_database()}`")
     st.write(f"- **Current Schema:** `{session.get_current_schema()}`")
\ No newline at end of file